@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Helper to read the result CSV files through an on-disk cache.
+Unpickling a parsed DataFrame is much faster than re-parsing the CSV, so the
+plot scripts reuse the parsed frame until the CSV changes.
+"""
+
+import hashlib
+import os
+import pickle
+import pandas as pd
+from file_utils import atomic_write
+
+# Set PLOT_FAST_IO=1 to parse with pandas' multithreaded pyarrow CSV engine
+# (opt-in; falls back to the default engine when pyarrow isn't installed or
+# rejects the read_csv arguments)
+FAST_IO_ENV = 'PLOT_FAST_IO'
+
+
+def _read_csv(csv_file: str, **read_csv_kwargs) -> pd.DataFrame:
+    """pd.read_csv, on the pyarrow engine when PLOT_FAST_IO=1 and it can handle the arguments."""
+    if os.environ.get(FAST_IO_ENV) == '1':
+        try:
+            return pd.read_csv(csv_file, engine='pyarrow', **read_csv_kwargs)
+        except (ImportError, ValueError):
+            # pyarrow not installed, or read_csv_kwargs the pyarrow engine
+            # doesn't support (e.g. some dtype/usecols forms)
+            pass
+    return pd.read_csv(csv_file, **read_csv_kwargs)
+
+
+def read_csv_cached(csv_file: str, **read_csv_kwargs) -> pd.DataFrame:
+    """
+    Equivalent to pd.read_csv(csv_file, **read_csv_kwargs), cached on disk.
+
+    The parsed DataFrame is pickled into a .cache/ directory next to the CSV,
+    one file per distinct set of read_csv arguments. It is reused only while
+    the CSV's mtime and size are unchanged. Caching is best-effort: if the
+    cache can't be read or written, the CSV is simply parsed. On a cache miss
+    the CSV is parsed with the pyarrow engine if PLOT_FAST_IO=1 is set.
+
+    Args:
+        csv_file: Path to the CSV file
+        **read_csv_kwargs: Extra arguments for pd.read_csv (usecols, dtype, ...)
+
+    Returns:
+        DataFrame with the CSV contents
+    """
+    stat = os.stat(csv_file)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    csv_path = os.path.abspath(csv_file)
+    cache_dir = os.path.join(os.path.dirname(csv_path), '.cache')
+    args_key = hashlib.sha1(repr(sorted(read_csv_kwargs.items())).encode('utf-8')).hexdigest()[:12]
+    cache_path = os.path.join(cache_dir, f'{os.path.basename(csv_path)}.{args_key}.pkl')
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_signature, df = pickle.load(f)
+        if cached_signature == signature:
+            return df
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError):
+        pass  # No usable cache yet
+
+    df = _read_csv(csv_file, **read_csv_kwargs)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with atomic_write(cache_path) as f:
+            pickle.dump((signature, df), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # Cache is best-effort
+
+    return df
@@ -1,63 +1,170 @@
 #!/usr/bin/env python3
 """
 Script to extract addresses/hosts from iperf3serverlist.net
-and convert them to a Python list and pandas DataFrame.
-Fetches the latest data from the website each time it runs.
+and convert them to a Python list.
+Fetches the latest data from the website, caching it on disk for an hour.
 """
 
-import pandas as pd
+import csv
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import time
+from functools import lru_cache
+from typing import Optional
 import requests
-from io import StringIO
+from file_utils import atomic_write
 
 
-def load_servers_dataframe(url: str = None) -> pd.DataFrame:
+SERVER_LIST_URL = 'https://export.iperf3serverlist.net/listed_iperf3_servers.csv'
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache')
+
+# (connect, read) timeout in seconds for the server list download, so a
+# stalled server falls back to the cached copy instead of hanging the run
+FETCH_TIMEOUT = (10, 60)
+
+# Column names recognised as holding the address, in order of preference
+ADDR_COLUMNS = ('IP/HOST', 'ip', 'host')
+
+
+def _cached_fetch(url: str, ttl: int = 3600) -> str:
     """
-    Load CSV data from URL into a pandas DataFrame.
+    Download a URL to an on-disk cache, reusing a copy younger than `ttl` seconds.
+    
+    The cache file lives under ~/.cache (or the temp dir if that is not
+    writable) and is keyed by the URL. The response body is streamed straight
+    to disk rather than held in memory. A stale copy is still used if the
+    network request fails, so runs work offline.
     
     Args:
-        url: URL to fetch CSV from. Defaults to iperf3serverlist.net export URL.
+        url: URL to fetch
+        ttl: Maximum cache age in seconds
     
     Returns:
-        DataFrame with server information
+        Path of the cached file
     """
-    if url is None:
-        url = 'https://export.iperf3serverlist.net/listed_iperf3_servers.csv'
+    cache_dir = CACHE_DIR
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        cache_dir = tempfile.gettempdir()
+    url_key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+    cache_path = os.path.join(cache_dir, f'iperf3_servers_{url_key}.csv')
     
-    # Fetch CSV data from URL
-    response = requests.get(url)
-    response.raise_for_status()  # Raise exception for bad status codes
+    try:
+        if time.time() - os.path.getmtime(cache_path) < ttl:
+            return cache_path
+    except OSError:
+        pass  # No cache yet
     
-    # Parse CSV from response text
-    df = pd.read_csv(StringIO(response.text))
+    try:
+        with requests.get(url, stream=True, timeout=FETCH_TIMEOUT) as response:
+            response.raise_for_status()  # Raise exception for bad status codes
+            
+            with atomic_write(cache_path) as f:
+                # iter_content undoes any gzip transfer encoding, and wraps
+                # a connection dropped mid-download in a RequestException
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+    except (requests.RequestException, OSError):
+        # Network failure, stalled download or unwritable cache dir:
+        # fall back to a stale copy if we have one
+        if os.path.exists(cache_path):
+            return cache_path
+        raise
+    return cache_path
+
+
+def _read_csv_column(csv_path: str) -> list[str]:
+    """Read the address column of a CSV file, skipping empty entries."""
+    if os.path.getsize(csv_path) == 0:
+        return []  # mmap cannot map an empty file
     
-    # Remove any rows with empty IP/HOST
-    df = df[df['IP/HOST'].notna() & (df['IP/HOST'].str.strip() != '')]
-    return df
+    # Memory-map the file and decode it through one TextIOWrapper, so the
+    # UTF-8 decoding and line splitting run in C rather than in a per-line
+    # Python .decode() generator
+    with open(csv_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            io.TextIOWrapper(io.BytesIO(mm), encoding='utf-8-sig', newline='') as text:
+        # Only one column is needed, so stream rows with csv.reader
+        reader = csv.reader(text)
+        header = next(reader, [])
+        
+        # Use the first recognised address column, else assume the first column
+        idx = next((header.index(name) for name in ADDR_COLUMNS if name in header), 0)
+        
+        # Skip any rows with empty IP/HOST
+        return [row[idx].strip() for row in reader if len(row) > idx and row[idx].strip()]
+
 
+def _read_text_list(path: str) -> list[str]:
+    """Read a plain text file with one address per line ('#' starts a comment line)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
 
-def extract_addrs_list(df: pd.DataFrame) -> list[str]:
-    """Extract IP/HOST column as a Python list."""
-    return df['IP/HOST'].tolist()
+
+@lru_cache(maxsize=4)
+def _load_servers_cached(source: str, mtime_ns: Optional[int]) -> tuple[str, ...]:
+    """Memoized body of load_servers(); mtime_ns is None for URLs and invalidates edited local files."""
+    if mtime_ns is not None:
+        if not source.lower().endswith('.csv'):
+            return tuple(_read_text_list(source))
+        csv_path = source
+    else:
+        # Fetch CSV data from URL (or a fresh on-disk copy of it)
+        csv_path = _cached_fetch(source)
+    
+    return tuple(_read_csv_column(csv_path))
+
+
+def load_servers(source: str = None) -> list[str]:
+    """
+    Load IP addresses/hostnames from a server list.
+    Repeated calls for the same source within a process reuse the parsed list.
+    
+    Args:
+        source: URL or local file path. Defaults to iperf3serverlist.net export URL.
+                URLs and .csv files are read as CSV using the IP/HOST (or ip/host)
+                column; other local files are read as one address per line.
+    
+    Returns:
+        List of IP addresses/hostnames, with empty entries removed
+    """
+    if source is None:
+        source = SERVER_LIST_URL
+    
+    # Local files are keyed on their mtime too; URLs are keyed on the URL alone
+    mtime_ns = os.stat(source).st_mtime_ns if os.path.exists(source) else None
+    
+    # Return a fresh list so callers may mutate it without touching the cache
+    return list(_load_servers_cached(source, mtime_ns))
+
+
+def _is_ipv4(addr: str) -> bool:
+    """Return True if addr is a dotted-quad IPv4 address (not a hostname)."""
+    # Plain string methods are much cheaper than a regex or ipaddress for this
+    # fixed shape; the cheap dot count rejects most hostnames up front
+    return addr.count('.') == 3 and all(
+        p.isdecimal() and len(p) <= 3 and int(p) <= 255 for p in addr.split('.'))
+
+
+def select_valid_ips(addrs: list[str]) -> list[str]:
+    """Filter a server list down to the entries that are IPv4 addresses."""
+    return [addr for addr in addrs if _is_ipv4(addr)]
 
 
 def main():
     print("Fetching latest iperf3 server list from iperf3serverlist.net...")
     
-    # Load into pandas DataFrame from URL
-    df = load_servers_dataframe()
-    
-    # Extract IPs as a list
-    addrs = extract_addrs_list(df)
+    # Load IPs/hosts as a list
+    addrs = load_servers()
     
     # Print as a Python list
     print("\n# List of iperf3 server IPs/hosts")
     print(f"IPERF3_SERVERS = {addrs}")
     print(f"\n# Total servers: {len(addrs)}")
-    
-    # Show DataFrame info
-    print("\n# DataFrame Preview:")
-    print(df.head(10))
-    print(f"\n# DataFrame shape: {df.shape}")
 
 
 if __name__ == '__main__':
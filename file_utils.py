@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+File helpers shared by the download cache (extract_addrs) and the CSV cache (csv_cache).
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path: str):
+    """
+    Open path for binary writing, atomically: the data goes to a temp file in
+    the same directory, which replaces path only once the with-block finishes.
+    A concurrent reader never sees a partial file, and on error the temp file
+    is removed and path is left as it was.
+
+    Args:
+        path: File to (over)write
+
+    Yields:
+        Binary file object to write to
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
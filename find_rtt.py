@@ -4,15 +4,113 @@ Script to find round-trip times to intermediate hops using traceroute.
 Picks 5 random IP addresses and traces the path to each destination.
 """
 
+import os
 import subprocess
 import re
 import random
-import csv
+import selectors
+import socket
 import sys
-import platform
-import statistics
-from typing import List, Dict, Tuple, Optional
-from extract_addrs import load_servers_dataframe, extract_addrs_list
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from itertools import compress, islice
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional, Union
+from extract_addrs import load_servers, select_valid_ips
+
+
+# Unix ping reply: "time=XX.XX ms" (compiled once rather than on every call)
+_PING_RTT_RE = re.compile(r'time=([\d\.]+)\s*ms', re.IGNORECASE)
+
+# Results live next to this script regardless of the caller's cwd
+RESULTS_PATH = Path(__file__).resolve().parent / 'traceroute_results.csv'
+
+
+@dataclass
+class HopBatch:
+    """
+    Traceroute hops stored column-wise: one list per field, indexed by hop.
+    Avoids a 7-key dict per hop, and whole columns can be reduced or
+    written out directly.
+    """
+    destination_ip: List[str] = field(default_factory=list)
+    hop_number: List[int] = field(default_factory=list)
+    hop_ip: List[Optional[str]] = field(default_factory=list)
+    min_rtt: List[float] = field(default_factory=list)
+    max_rtt: List[float] = field(default_factory=list)
+    avg_rtt: List[float] = field(default_factory=list)
+    responsive: List[bool] = field(default_factory=list)
+    
+    def __len__(self) -> int:
+        return len(self.hop_number)
+    
+    def append(self, destination_ip: str, hop_number: int, hop_ip: Optional[str],
+               min_rtt: float, max_rtt: float, avg_rtt: float, responsive: bool):
+        """Append a single hop."""
+        self.destination_ip.append(destination_ip)
+        self.hop_number.append(hop_number)
+        self.hop_ip.append(hop_ip)
+        self.min_rtt.append(min_rtt)
+        self.max_rtt.append(max_rtt)
+        self.avg_rtt.append(avg_rtt)
+        self.responsive.append(responsive)
+    
+    def extend(self, other: 'HopBatch'):
+        """Append all hops of another batch."""
+        for f in fields(self):
+            getattr(self, f.name).extend(getattr(other, f.name))
+    
+    def rtt_stats(self) -> Optional[Tuple[int, float, float, float]]:
+        """
+        Summarize the responsive hops.
+        
+        Returns:
+            Tuple of (count, mean avg_rtt, min min_rtt, max max_rtt), or None if
+            no hop responded
+        """
+        # Each reduction is a single C-level pass over one column, streaming
+        # the responsive values through compress(); no per-hop dict lookups
+        # or filtered copy of the batch
+        count = sum(self.responsive)
+        if not count:
+            return None
+        return (count, sum(compress(self.avg_rtt, self.responsive)) / count,
+                min(compress(self.min_rtt, self.responsive)),
+                max(compress(self.max_rtt, self.responsive)))
+    
+    def last_responsive_index(self) -> Optional[int]:
+        """Index of the final responsive hop (normally the destination), or None."""
+        # list.index runs in C; search the reversed column from the end
+        try:
+            return len(self) - 1 - self.responsive[::-1].index(True)
+        except ValueError:
+            return None
+    
+    def reached(self, ip: str) -> bool:
+        """True if the final responsive hop is the destination (an IP or hostname) itself."""
+        # A trace cut short (overall timeout, max hops) ends at an intermediate router
+        # hop_ip is always numeric, so compare against the destination's address
+        final_hop = self.last_responsive_index()
+        return final_hop is not None and self.hop_ip[final_hop] == resolve_target(ip)
+
+
+@lru_cache(maxsize=256)
+def resolve_target(ip: str) -> str:
+    """
+    Resolve a traceroute target to its IPv4 address (IPs come back unchanged).
+    
+    Args:
+        ip: Destination IP address or hostname
+    
+    Returns:
+        The IPv4 address, or ip itself if it doesn't resolve
+    """
+    try:
+        return socket.gethostbyname(ip)
+    except (socket.gaierror, UnicodeError):
+        return ip
 
 
 def run_ping(ip: str, count: int = 3) -> Optional[Dict[str, float]]:
@@ -46,7 +144,7 @@ def run_ping(ip: str, count: int = 3) -> Optional[Dict[str, float]]:
         rtts = []
 
         # Unix ping format: "time=XX.XX ms"
-        rtt_matches = re.findall(r'time=([\d\.]+)\s*ms', result.stdout, re.IGNORECASE)
+        rtt_matches = _PING_RTT_RE.findall(result.stdout)
         rtts = [float(r) for r in rtt_matches]
         
         if rtts:
@@ -67,43 +165,76 @@ def run_ping(ip: str, count: int = 3) -> Optional[Dict[str, float]]:
         return None
 
 
-def run_traceroute(ip: str, max_hops: int = 30, timeout: int = 2) -> str:
+def run_traceroute(ip: str, max_hops: int = 30, timeout: int = 2, overall_timeout: int = 120) -> str:
     """
     Run traceroute command for the given IP address.
     
+    Output is read as it is produced, so tracing stops as soon as the
+    destination answers, and hops seen before the overall timeout are kept
+    instead of being thrown away.
+    
     Args:
         ip: Destination IP address
         max_hops: Maximum number of hops to trace
         timeout: Timeout in seconds for each hop
+        overall_timeout: Timeout in seconds for the whole trace
     
     Returns:
-        Raw traceroute output as string
+        Raw traceroute output as string (possibly partial)
     """
     try:
         # Unix/Linux traceroute command
         cmd = ['traceroute', '-m', str(max_hops), '-w', str(timeout), ip]
         
         print(f"Running traceroute to {ip}...")
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=120  # Overall timeout of 2 minutes
-        )
-        return result.stdout
-    
-    except subprocess.TimeoutExpired:
-        print(f"Warning: Traceroute to {ip} timed out")
-        return ""
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
     except FileNotFoundError:
         print(f"Error: Traceroute command not found. Make sure it's installed.")
         return ""
     except Exception as e:
         print(f"Error running traceroute to {ip}: {e}")
         return ""
+    
+    chunks = []
+    pending = b''
+    dest_marker = f'({ip})'.encode()
+    deadline = time.monotonic() + overall_timeout
+    
+    try:
+        fd = proc.stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Warning: Traceroute to {ip} timed out, keeping partial output")
+                    break
+                if not selector.select(remaining):
+                    continue
+                
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    break  # traceroute exited
+                chunks.append(chunk)
+                
+                # Stop early once a complete hop line shows the destination
+                # (the "traceroute to ..." banner also contains it, so only
+                # lines starting with a hop number count)
+                *lines, pending = (pending + chunk).split(b'\n')
+                if any(dest_marker in line and line.lstrip()[:1].isdigit() for line in lines):
+                    break
+    except Exception as e:
+        print(f"Error running traceroute to {ip}: {e}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        proc.stdout.close()
+    
+    return b''.join(chunks).decode('utf-8', errors='replace')
 
 
-def parse_traceroute(output: str, destination_ip: str) -> List[Dict[str, any]]:
+def parse_traceroute(output: str, destination_ip: str) -> HopBatch:
     """
     Parse Unix/Linux traceroute output.
     
@@ -117,71 +248,108 @@ def parse_traceroute(output: str, destination_ip: str) -> List[Dict[str, any]]:
         destination_ip: Destination IP being traced
     
     Returns:
-        List of hop dictionaries with hop_number, hop_ip, and rtt values
+        HopBatch with hop_number, hop_ip, and rtt values for each hop
     """
-    hops = []
-    lines = output.split('\n')
-    
-    # Pattern to match traceroute lines
-    hop_pattern = re.compile(
-        r'^\s*(\d+)\s+' +  # Hop number
-        r'(?:([^\s\(]+)\s+)?' +  # Optional hostname
-        r'(?:\(([^\)]+)\))?' +  # IP in parentheses
-        r'(.+)$'  # Rest of line with RTTs
-    )
-    
-    # Pattern for * * * lines
-    timeout_pattern = re.compile(r'^\s*(\d+)\s+\*\s+\*\s+\*')
-    
-    for line in lines:
-        # Check for timeout lines first (* * * hops)
-        timeout_match = timeout_pattern.match(line)
-        if timeout_match:
-            hop_num = int(timeout_match.group(1))
-            # Add non-responsive hop with 0ms RTT (will be filtered later)
-            hops.append({
-                'destination_ip': destination_ip,
-                'hop_number': hop_num,
-                'hop_ip': None,  # No IP for non-responsive hop
-                'min_rtt': 0.0,
-                'max_rtt': 0.0,
-                'avg_rtt': 0.0,
-                'is_responsive': False
-            })
+    hops = HopBatch()
+    
+    # Hand-rolled tokenizer: the format is fixed enough that splitting on
+    # whitespace and probing tokens is much cheaper than running a regex.
+    for line in output.splitlines():
+        # Hop lines start with the hop number. Checking the first character
+        # skips the header and blank lines before paying for a split().
+        stripped = line.lstrip()
+        if not stripped or not stripped[0].isdigit():
             continue
         
-        match = hop_pattern.match(line)
-        if match:
-            hop_num = int(match.group(1))
-            hostname = match.group(2)
-            ip_addr = match.group(3)
-            rtt_part = match.group(4)
-            
-            # If line has only asterisks, skip it (already handled above)
-            if '*' in line and not ip_addr:
-                continue
-            
-            # Extract RTT values
-            rtt_matches = re.findall(r'([\d\.]+)\s*ms', rtt_part)
-            
-            if rtt_matches and ip_addr:
-                rtts = [float(r) for r in rtt_matches]
-                avg_rtt = sum(rtts) / len(rtts)
-                min_rtt = min(rtts)
-                max_rtt = max(rtts)
-                
-                hops.append({
-                    'destination_ip': destination_ip,
-                    'hop_number': hop_num,
-                    'hop_ip': ip_addr,
-                    'min_rtt': min_rtt,
-                    'max_rtt': max_rtt,
-                    'avg_rtt': avg_rtt,
-                    'is_responsive': True
-                })
+        parts = stripped.split()
+        if not parts[0].isdigit():
+            continue
+        hop_num = int(parts[0])
+        
+        # Timeout line (* * *) for a non-responsive hop
+        if parts[1:4] == ['*', '*', '*']:
+            # Add non-responsive hop with no IP and 0ms RTT (will be filtered later)
+            hops.append(destination_ip, hop_num, None, 0.0, 0.0, 0.0, False)
+            continue
+        
+        # The first "(ip)" token is the hop address; each "ms" token is
+        # preceded by one RTT sample. Min/max/sum are folded in the same pass.
+        ip_addr = None
+        count = 0
+        min_rtt = max_rtt = total = 0.0
+        for i in range(1, len(parts)):
+            token = parts[i]
+            if token == 'ms':
+                try:
+                    rtt = float(parts[i - 1])
+                except ValueError:
+                    continue
+                if count == 0:
+                    min_rtt = max_rtt = rtt
+                elif rtt < min_rtt:
+                    min_rtt = rtt
+                elif rtt > max_rtt:
+                    max_rtt = rtt
+                total += rtt
+                count += 1
+            elif ip_addr is None and token[0] == '(' and token[-1] == ')':
+                ip_addr = token[1:-1]
+        
+        if ip_addr and count:
+            hops.append(destination_ip, hop_num, ip_addr,
+                        min_rtt, max_rtt, total / count, True)
     
     return hops
 
+
+def trace_and_parse(ip: str) -> Tuple[str, Optional[HopBatch]]:
+    """
+    Trace the route to one destination and parse its hops.
+    If the trace reached the destination, the final hop's RTT is replaced with
+    a ping measurement; a partial trace (see HopBatch.reached) is left as is.
+    Safe to call from worker threads.
+    
+    Args:
+        ip: Destination IP address (or hostname, which is resolved first)
+    
+    Returns:
+        Tuple of (ip, hops), where hops is None if traceroute produced no output
+    """
+    # Resolve a hostname once, so traceroute's early stop and the reached()
+    # check below both match the numeric hop address of the destination
+    target_ip = resolve_target(ip)
+    
+    # The ping doesn't depend on the traceroute output (only the final-hop
+    # patch below does), so run both child processes at the same time.
+    # Wall time per destination becomes max(trace, ping) instead of the sum.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        ping_future = executor.submit(run_ping, target_ip)
+        output = run_traceroute(target_ip)
+        ping_result = ping_future.result()
+    
+    if not output:
+        return ip, None
+    
+    hops = parse_traceroute(output, ip)
+    
+    # Get the final responsive hop (which should be the destination)
+    final_hop = hops.last_responsive_index()
+    
+    # (a trace with no responsive hop has nothing to warn about or patch)
+    if final_hop is not None and not hops.reached(target_ip):
+        # The ping measures the destination, so it must not overwrite the RTT
+        # of the intermediate router a partial trace stopped at
+        print(f"Warning: traceroute to {ip} did not reach the destination (incomplete trace)")
+    elif final_hop is not None and ping_result:
+        # Use ping to get RTT for the final hop
+        print(f"Replacing final hop RTT for {ip} with ping result")
+        hops.min_rtt[final_hop] = ping_result['min_rtt']
+        hops.max_rtt[final_hop] = ping_result['max_rtt']
+        hops.avg_rtt[final_hop] = ping_result['avg_rtt']
+    
+    return ip, hops
+
+
 def select_random_ips(num_ips: int = 5) -> List[str]:
     """
     Select random IP addresses from the iperf3 server list.
@@ -193,13 +361,8 @@ def select_random_ips(num_ips: int = 5) -> List[str]:
         List of IP addresses
     """
     print("Loading iperf3 server list...")
-    df = load_servers_dataframe()
-    addrs = extract_addrs_list(df)
-    
-    # Filter to get only valid IPs (not hostnames)
-    # Simple check: contains dots and starts with a digit
-    ip_pattern = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
-    valid_ips = [addr for addr in addrs if ip_pattern.match(addr)]
+    # Keep only valid IPs (not hostnames)
+    valid_ips = select_valid_ips(load_servers())
     
     print(f"Found {len(valid_ips)} valid IP addresses")
     
@@ -211,42 +374,48 @@ def select_random_ips(num_ips: int = 5) -> List[str]:
     return selected
 
 
-def write_results_to_csv(hops: List[Dict[str, any]], output_file: str = 'p1/traceroute_results.csv'):
+def write_results_to_csv(hops: HopBatch, output_file: Union[str, Path] = RESULTS_PATH):
     """
     Write traceroute results to CSV file.
     Filters out non-responsive hops before writing.
     
     Args:
-        hops: List of hop dictionaries
-        output_file: Output CSV filename
+        hops: Batch of parsed hops
+        output_file: Output CSV path (created along with its parent directory)
     """
     if not hops:
         print("No hops to write to CSV")
         return
     
-    # Filter out non-responsive hops (those with is_responsive=False)
-    responsive_hops = [h for h in hops if h.get('is_responsive', True)]
+    responsive_count = sum(hops.responsive)
     
-    if not responsive_hops:
+    if not responsive_count:
         print("No responsive hops to write to CSV")
         return
     
-    # Define CSV columns (exclude is_responsive field)
+    # Define CSV columns (exclude responsive field)
     fieldnames = ['destination_ip', 'hop_number', 'hop_ip', 'min_rtt', 'max_rtt', 'avg_rtt']
     
-    # Remove is_responsive field from dictionaries before writing
-    csv_hops = []
-    for hop in responsive_hops:
-        csv_hop = {k: v for k, v in hop.items() if k in fieldnames}
-        csv_hops.append(csv_hop)
+    # Rows are zipped straight from the columns in fieldnames order and
+    # non-responsive hops are dropped lazily, so no filtered copy is built
+    rows = compress(zip(hops.destination_ip, hops.hop_number, hops.hop_ip,
+                        hops.min_rtt, hops.max_rtt, hops.avg_rtt), hops.responsive)
+    
+    # Every field is a number or a bare IP address, so the csv module's
+    # quoting machinery isn't needed; format the whole file as one string
+    # Rows end in '\r\n' like csv.writer's default, so the bytes are unchanged
+    body = ''.join([f'{dest},{hop_number},{hop_ip},{min_rtt},{max_rtt},{avg_rtt}\r\n'
+                    for dest, hop_number, hop_ip, min_rtt, max_rtt, avg_rtt in rows])
+    if body.count(',') != (len(fieldnames) - 1) * responsive_count or '"' in body:
+        raise ValueError("Traceroute fields contain characters that need CSV quoting")
     
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(csv_hops)
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with output_file.open('w', newline='', encoding='utf-8') as csvfile:
+        csvfile.write(','.join(fieldnames) + '\r\n' + body)
     
     print(f"\nResults written to {output_file}")
-    print(f"Total responsive hops recorded: {len(csv_hops)}")
+    print(f"Total responsive hops recorded: {responsive_count}")
 
 
 def main():
@@ -266,70 +435,57 @@ def main():
         print("No valid IPs found")
         return 1
     
-    # Run traceroute for each IP and collect results
-    all_hops = []
+    # Run traceroute for all IPs concurrently and collect results.
+    # Each trace spends nearly all of its time waiting on the external
+    # traceroute/ping processes, so threads overlap them almost perfectly.
+    all_hops = HopBatch()
     successful_traces = 0
     
-    for i, ip in enumerate(selected_ips, 1):
-        print(f"\n[{i}/{len(selected_ips)}] Tracing route to {ip}")
-        print("-" * 70)
+    with ThreadPoolExecutor(max_workers=min(8, len(selected_ips))) as executor:
+        # map() yields in submission order, so aggregation and printing
+        # below stay serialized in the main thread
+        traces = executor.map(trace_and_parse, selected_ips)
         
-        output = run_traceroute(ip)
-    
-        if output:
-            hops = parse_traceroute(output, ip)
+        for i, (ip, hops) in enumerate(traces, 1):
+            print(f"\n[{i}/{len(selected_ips)}] Route to {ip}")
+            print("-" * 70)
             
-            if hops:
-                # Filter to only responsive hops for counting
-                responsive_hops = [h for h in hops if h.get('is_responsive', True)]
-                print(f"Found {len(responsive_hops)} responsive hops (out of {len(hops)} total)")
-                
-                # Replace final hop RTT with ping RTT
-                if responsive_hops:
-                    # Get the final responsive hop (which should be the destination)
-                    final_hop = None
-                    for hop in reversed(hops):
-                        if hop.get('is_responsive', True) and hop.get('hop_ip'):
-                            final_hop = hop
-                            break
-                    
-                    if final_hop:
-                        # Use ping to get RTT for the final hop
-                        ping_result = run_ping(ip)
-                        if ping_result:
-                            print(f"Replacing final hop RTT with ping result")
-                            final_hop['min_rtt'] = ping_result['min_rtt']
-                            final_hop['max_rtt'] = ping_result['max_rtt']
-                            final_hop['avg_rtt'] = ping_result['avg_rtt']
+            if hops is None:
+                print(f"Warning: Failed to trace route to {ip}")
+            elif hops:
+                # Count responsive hops straight off the flag column
+                responsive_count = sum(hops.responsive)
+                print(f"Found {responsive_count} responsive hops (out of {len(hops)} total)")
+                if responsive_count and not hops.reached(ip):
+                    print(f"Note: incomplete trace, {ip} itself never responded")
                 
                 all_hops.extend(hops)
                 successful_traces += 1
                 
-                # Print summary for this destination (only responsive hops)
-                hop_summary = ', '.join([f"{h['hop_number']}:{h['hop_ip']}" 
-                                        for h in responsive_hops[:5] if h.get('hop_ip')])
-                if len(responsive_hops) > 5:
+                # Print summary for this destination (first 5 responsive hops only)
+                first_hops = islice(compress(zip(hops.hop_number, hops.hop_ip), hops.responsive), 5)
+                hop_summary = ', '.join([f"{hop_number}:{hop_ip}" for hop_number, hop_ip in first_hops])
+                if responsive_count > 5:
                     hop_summary += "..."
                 print(f"Responsive hops: {hop_summary}")
             else:
                 print(f"Warning: No hops found for {ip}")
-        else:
-            print(f"Warning: Failed to trace route to {ip}")
     
     # Write results to CSV
     print("\n" + "=" * 70)
     print(f"Traceroute completed for {successful_traces}/{len(selected_ips)} destinations")
     
     if all_hops:
-        write_results_to_csv(all_hops, 'traceroute_results.csv')
+        write_results_to_csv(all_hops, RESULTS_PATH)
         
         # Print statistics (only for responsive hops)
-        responsive_hops = [h for h in all_hops if h.get('is_responsive', True)]
-        if responsive_hops:
+        stats = all_hops.rtt_stats()
+        if stats:
+            count, mean_rtt, min_rtt, max_rtt = stats
             print(f"\nStatistics:")
-            print(f"  Total responsive hops: {len(responsive_hops)}")
-            print(f"  Average RTT across all responsive hops: {sum(h['avg_rtt'] for h in responsive_hops) / len(responsive_hops):.2f} ms")
-            print(f"  RTT range: {min(h['min_rtt'] for h in responsive_hops):.2f} - {max(h['max_rtt'] for h in responsive_hops):.2f} ms")
+            print(f"  Total responsive hops: {count}")
+            print(f"  Average RTT across all responsive hops: {mean_rtt:.2f} ms")
+            print(f"  RTT range: {min_rtt:.2f} - {max_rtt:.2f} ms")
         else:
             print("No responsive hops found across all destinations")
             return 1
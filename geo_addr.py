@@ -2,80 +2,247 @@
 """
 Script to map IP/hostnames addresses to their geographical locations using a GeoIP database.
 Provides distance between West Lafayette, IN and the IP locations, in km
+Lookups are cached on disk (~/.cache/geo_cache) for 24 h so re-runs skip the API.
 
 You need to "pip install requests"
 """
  
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain, islice
+from math import radians, sin, cos, sqrt, asin
+import dbm
+import json
+import logging
+import os
+import shelve
+import threading
+import numpy as np
 import requests
+try:
+    from orjson import loads as json_loads  # optional, decodes batch replies faster
+except ImportError:
+    from json import loads as json_loads
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 
-    
-# This function maps IPs to geo locations, including distance calculation from us to them
-# 
-# Example element
-# IP 103.146.200.98: {'country': 'Papua New Guinea', 'regionName': 'National Capital', 'city': 'Port Moresby', 'lat': -9.43529, 3 # 'lon': 147.18, 'my_lat': 40.4444, 'my_lon': -86.9256, 'my_city': 'West Lafayette', 'my_region': 'Indiana', 'my_country': 'United # States', 'distance_km': 13691.116359279862}
-# 
-def get_geo(addrs):
-    print("Mapping Addr to geo location...")
+# Per-Addr progress goes through logging so it costs nothing unless enabled
+logger = logging.getLogger(__name__)
+
+# At most this many ip-api requests are in flight at once
+MAX_CONCURRENT_REQUESTS = 8
+
+# ip-api answers are cached on disk by Addr, so re-runs skip the network
+GEO_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'geo_cache')
+# Held while the cache file is open; shelve does not support concurrent access
+_geo_cache_lock = threading.Lock()
+
+# Cached geo answers are re-fetched after this many sec (servers move rarely)
+GEO_CACHE_TTL = 24 * 3600
+# Our own public Addr is re-checked with ipify after this many sec
+PUBLIC_IP_TTL = 600
+
+
+# Open the on-disk geo cache; fall back to an in-memory dict (no persistence)
+# if it can't be created or is locked by another run
+def open_geo_cache():
+    try:
+        os.makedirs(os.path.dirname(GEO_CACHE_PATH), exist_ok=True)
+        return shelve.open(GEO_CACHE_PATH)
+    except (OSError, dbm.error) as e:
+        print(f"Geo cache unavailable, not persisting lookups: {e}")
+        return {}
+
+
+# Cache entries are (timestamp, value); cache_get returns the value, or None
+# if it is missing, older than ttl sec, or in a pre-TTL format
+def cache_get(cache, key, ttl=GEO_CACHE_TTL):
+    entry = cache.get(key)
+    if isinstance(entry, tuple) and time.time() - entry[0] < ttl:
+        return entry[1]
+    return None
+
 
-    # Haversine formula to calculate distance between two lat/lon points in km
-    # https://en.wikipedia.org/wiki/Haversine_formula
-    def get_distance_km(my_lat, my_lon, dest_lat, dest_lon):
-        from math import radians, sin, cos, sqrt, atan2
-        R = 6371.0  # Earth radius in km
+def cache_put(cache, key, value):
+    cache[key] = (time.time(), value)
 
-        # Convert degrees to radians
-        my_lat, my_lon = radians(my_lat), radians(my_lon)
-        dest_lat, dest_lon = radians(dest_lat), radians(dest_lon)
 
-        # Haversine formula
-        dlon = dest_lon - my_lon  # Δλ = λ₂ - λ₁
-        dlat = dest_lat - my_lat  # Δφ = φ₂ - φ₁
+# One pooled, keep-alive session per get_geo() call, so successive ip-api /
+# ipify requests reuse their TCP connections. The adapter retries failed
+# connects; HTTP 429s are handled by send_with_retry below (used by fetch_geo
+# and fetch_geo_batch)
+def make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16,
+                          max_retries=Retry(total=3, backoff_factor=1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
-        hav_dlat = sin(dlat / 2)**2 # hav(Δφ)
-        hav_dlon = sin(dlon / 2)**2 # hav(Δλ)
-        hav_angle = hav_dlat + cos(my_lat) * cos(dest_lat) * hav_dlon
+# Our origin in radians plus cos(lat); it is the same for every destination
+# (and every get_geo() call), so these are computed once, not per distance
+@lru_cache(maxsize=8)
+def origin_radians(my_lat, my_lon):
+    my_lat_r = radians(my_lat)
+    return my_lat_r, radians(my_lon), cos(my_lat_r)
 
-        angle = 2 * atan2(sqrt(hav_angle), sqrt(1 - hav_angle)) # angle = 2 * arcsin(√hav(angle))
 
-        distance = R * angle # This will get distance in km
-        return distance
+# Haversine formula to calculate distance between two lat/lon points in km
+# https://en.wikipedia.org/wiki/Haversine_formula
+# Memoized, since the same origin/destination pairs recur across calls
+@lru_cache(maxsize=4096)
+def haversine_km(my_lat, my_lon, dest_lat, dest_lon):
+    R = 6371.0  # Earth radius in km
 
-    # Request ip info from ip-api.com, it sleeps 1.5 sec to avoid rate limitation, it returns json data
-    def request_api_info(addr): 
-        url = f'http://ip-api.com/json/{addr}'
+    # Convert degrees to radians
+    my_lat, my_lon, cos_my_lat = origin_radians(my_lat, my_lon)
+    dest_lat, dest_lon = radians(dest_lat), radians(dest_lon)
+
+    # Haversine formula
+    dlon = dest_lon - my_lon  # Δλ = λ₂ - λ₁
+    dlat = dest_lat - my_lat  # Δφ = φ₂ - φ₁
+
+
+    hav_dlat = sin(dlat / 2)**2 # hav(Δφ)
+    hav_dlon = sin(dlon / 2)**2 # hav(Δλ)
+    hav_angle = hav_dlat + cos_my_lat * cos(dest_lat) * hav_dlon
+
+    # angle = 2 * arcsin(√hav(angle)); clamped as rounding can push it past 1
+    angle = 2 * asin(min(1.0, sqrt(hav_angle)))
+
+    distance = R * angle # This will get distance in km
+    return distance
+
+
+# Same formula over arrays of destinations, one NumPy pass for all of them
+def haversine_km_array(my_lat, my_lon, dest_lats, dest_lons):
+    R = 6371.0  # Earth radius in km
+    my_lat, my_lon, cos_my_lat = origin_radians(my_lat, my_lon)
+    dest_lats, dest_lons = np.radians(dest_lats), np.radians(dest_lons)
+
+    hav_angle = (np.sin((dest_lats - my_lat) / 2)**2
+                 + cos_my_lat * np.cos(dest_lats) * np.sin((dest_lons - my_lon) / 2)**2)
+    return 2 * R * np.arcsin(np.minimum(1.0, np.sqrt(hav_angle)))
+
+
+# ip-api.com allows 45 single / 15 batch requests per min; requests *start*
+# at least `interval` sec apart but run concurrently, so one slow response
+# no longer delays the next
+_next_slot = [time.monotonic()]
+_slot_lock = threading.Lock()
+
+def wait_for_slot(interval=1.5):
+    with _slot_lock:
+        now = time.monotonic()
+        slot = max(now, _next_slot[0])
+        _next_slot[0] = slot + interval
+    if slot > now:
+        time.sleep(slot - now)
+
+
+# Send a request, retrying on HTTP 429/5xx and connection errors. On 429,
+# ip-api reports in X-Ttl how many sec until the limit resets; otherwise
+# back off exponentially (1, 2, 4, ... sec, capped at 60)
+def send_with_retry(send, attempts=5):
+    for attempt in range(attempts):
+        last_try = attempt == attempts - 1
         try:
-            response = requests.get(url)
-            data = response.json()
-            # handle HTTP errors
-            response.raise_for_status()
-            return data
-        except Exception as e:
-            print(f"Error fetching data for Addr {addr}: {e}")
-            return None
-        finally:
-            # Avoid limitation rate
-            time.sleep(1.5) 
+            response = send()
+        except requests.ConnectionError:
+            if last_try: raise
+            time.sleep(min(60, 2 ** attempt))
+            continue
+        if last_try or (response.status_code != 429 and response.status_code < 500):
+            return response
+        ttl = response.headers.get('X-Ttl', '')
+        if response.status_code == 429 and ttl.isdigit():
+            time.sleep(int(ttl) + 1)
+        else:
+            time.sleep(min(60, 2 ** attempt))
+
+
+# Request ip info from ip-api.com, paced by wait_for_slot(), it returns json data
+# (None on failure)
+def fetch_geo(session, addr):
+    url = f'http://ip-api.com/json/{addr}'
+    wait_for_slot()
+    try:
+        response = send_with_retry(lambda: session.get(url, timeout=10))
+        data = json_loads(response.content)
+        # handle HTTP errors
+        response.raise_for_status()
+        return data
+    except Exception as e:
+        print(f"Error fetching data for Addr {addr}: {e}")
+        return None
+
+
+# Request ip info for up to 100 addrs in one POST to ip-api.com/batch,
+# it returns one json entry per addr, in the same order (None on failure)
+def fetch_geo_batch(session, batch):
+    wait_for_slot(4.0)
+    try:
+        payload = [{'query': addr} for addr in batch]
+        response = send_with_retry(lambda: session.post('http://ip-api.com/batch',
+                                                        json=payload, timeout=10))
+        response.raise_for_status()
+        return json_loads(response.content)
+    except Exception as e:
+        print(f"Error fetching data for batch of {len(batch)} Addrs: {e}")
+        return [None] * len(batch)
+
 
-    # Get our own IP geo location, it uses ipify.org to get public IP
-    def get_my_public_ip():
+# Get our own IP geo location, it uses ipify.org to get public IP
+# (reused from the cache for PUBLIC_IP_TTL sec)
+def get_my_public_ip(session, cache):
+    cached = cache_get(cache, '__my_public_ip__', PUBLIC_IP_TTL)
+    if cached:
+        return cached
+    try:
+        response = session.get('https://api.ipify.org', timeout=5)
+        response.raise_for_status()
+        cache_put(cache, '__my_public_ip__', response.text)
+        return response.text
+    except requests.RequestException as e:
+        print(f"Failed to get public Addr: {e}")
+        return None
+
+
+# This function maps IPs to geo locations, including distance calculation from us to them
+# 
+# Example element
+# IP 103.146.200.98: {'country': 'Papua New Guinea', 'regionName': 'National Capital', 'city': 'Port Moresby', 'lat': -9.43529, 3 # 'lon': 147.18, 'my_lat': 40.4444, 'my_lon': -86.9256, 'my_city': 'West Lafayette', 'my_region': 'Indiana', 'my_country': 'United # States', 'distance_km': 13691.116359279862}
+# 
+# If jsonl_path is given, each located Addr is also appended to it as one JSON
+# line ({'addr': ..., **geo info}) as soon as its lookup completes
+# Calls from several threads (e.g. ping_addr workers) are serialized, since
+# they share the one on-disk cache file
+def get_geo(addrs, jsonl_path=None):
+    with _geo_cache_lock:
+        cache = open_geo_cache()
         try:
-            response = requests.get('https://api.ipify.org', timeout=5)
-            response.raise_for_status()
-            return response.text
-        except requests.RequestException as e:
-            print(f"Failed to get public Addr: {e}")
-            return None
-    
+            with make_session() as session:
+                return get_geo_cached(addrs, cache, session, jsonl_path)
+        finally:
+            if isinstance(cache, shelve.Shelf):
+                cache.close()
+
+
+# get_geo() body; `cache` maps Addr -> ip-api json and is only touched from
+# this thread (shelve is not thread-safe), never from the fetch workers.
+# All HTTP goes through `session`
+def get_geo_cached(addrs, cache, session, jsonl_path=None):
+    print("Mapping Addr to geo location...")
+
     # Get addr using our function
-    my_addr = get_my_public_ip()
+    my_addr = get_my_public_ip(session, cache)
     if my_addr is None:
         print("We need a valid public Addr to calculate distance.")
         return None
     # Get geo info for our public Addr
-    my_geo = request_api_info(my_addr)
+    my_geo = cache_get(cache, my_addr) or fetch_geo(session, my_addr)
     
     if my_geo is None or my_geo['status'] != 'success':
         print("We need geo info for our public Addr.")
@@ -91,6 +258,7 @@ def get_geo(addrs):
     my_region = my_geo.get('regionName', 'IN')
     my_country = my_geo.get('country', 'USA')
     print(f"Our location: {my_city}, {my_region}, {my_country} ({my_lat}, {my_lon})")
+    cache_put(cache, my_addr, my_geo)
 
     # Start processing Addrs
     print("##############")
@@ -98,34 +266,92 @@ def get_geo(addrs):
 
     # Dictionary to hold Addr to geo info mapping [addr -> {geo info}]
     # addr should be unique
-    addr_geo_map = defaultdict(dict)
-
-    # Populate the map
-    for addr in addrs:
-        if addr is None: continue
-        data = request_api_info(addr)
-        if data and data['status'] == 'success':
-            if addr in addr_geo_map: continue  # Skip if already processed
-            addr_geo_map[addr]['country'] = data.get('country', 'N/A')
-            addr_geo_map[addr]['regionName'] = data.get('regionName', 'N/A')
-            addr_geo_map[addr]['city'] = data.get('city', 'N/A')
-            addr_geo_map[addr]['lat'] = data.get('lat', 'N/A')
-            addr_geo_map[addr]['lon'] = data.get('lon', 'N/A')
-            if addr_geo_map[addr]['lat'] == 'N/A' or addr_geo_map[addr]['lon'] == 'N/A':
-                print(f"Addr {addr} has no valid lat/lon data.")
-                continue
-            # Get distance from West Lafayette, IN to Addr location
-            addr_geo_map[addr]['my_lat'] = my_lat
-            addr_geo_map[addr]['my_lon'] = my_lon
-            addr_geo_map[addr]['my_city'] = my_city
-            addr_geo_map[addr]['my_region'] = my_region
-            addr_geo_map[addr]['my_country'] = my_country
-            distance = get_distance_km(my_lat, my_lon, addr_geo_map[addr]['lat'], addr_geo_map[addr]['lon'])
-            addr_geo_map[addr]['distance_km'] = distance
-            print(f"Addr {addr}: {addr_geo_map[addr]}")
+    addr_geo_map = {}
+
+    # Our own location, shared by every located Addr's entry
+    origin = {
+        'my_lat': my_lat,
+        'my_lon': my_lon,
+        'my_city': my_city,
+        'my_region': my_region,
+        'my_country': my_country,
+    }
+
+    # Populate the map from a chunk of (addr, data) pairs, then fill in the
+    # distance from West Lafayette, IN for every located Addr in the chunk.
+    # NumPy only pays off for several points, so a single Addr keeps the
+    # scalar math path. Returns the located Addrs
+    def add_chunk(chunk):
+        located = []
+        for addr, data in chunk:
+            if data and data['status'] == 'success':
+                lat, lon = data.get('lat', 'N/A'), data.get('lon', 'N/A')
+                addr_geo_map[addr] = {
+                    'country': data.get('country', 'N/A'),
+                    'regionName': data.get('regionName', 'N/A'),
+                    'city': data.get('city', 'N/A'),
+                    'lat': lat,
+                    'lon': lon,
+                }
+                if lat == 'N/A' or lon == 'N/A':
+                    logger.debug("Addr %s has no valid lat/lon data.", addr)
+                    continue
+                addr_geo_map[addr].update(origin)
+                located.append(addr)
+            else:
+                # Record the failure and move on; one bad Addr must not cost the rest
+                error = data.get('message', 'error') if data else 'network'
+                addr_geo_map[addr] = {'error': error}
+                logger.debug("Failed to get data for Addr %s: %s", addr, error)
+
+        if len(located) == 1:
+            geo = addr_geo_map[located[0]]
+            distances = [haversine_km(my_lat, my_lon, geo['lat'], geo['lon'])]
         else:
-            print(f"Failed to get data for Addr {addr}: {data.get('message', 'error')}")
-            pass
+            lats = [addr_geo_map[addr]['lat'] for addr in located]
+            lons = [addr_geo_map[addr]['lon'] for addr in located]
+            distances = haversine_km_array(my_lat, my_lon, lats, lons).tolist()
+        for addr, distance in zip(located, distances):
+            addr_geo_map[addr]['distance_km'] = distance
+            logger.debug("Addr %s: %s", addr, addr_geo_map[addr])
+        return located
+
+    # Fetch the Addrs missing from the cache (or stale) in batches of 100
+    # (concurrently if there are several). Duplicates and empty entries are
+    # dropped up front so each Addr is looked up once
+    addrs = list(dict.fromkeys(filter(None, addrs)))
+    cached = {addr: cache_get(cache, addr) for addr in addrs}
+    missing = [addr for addr in addrs if cached[addr] is None]
+    print(f"Geo cache hits: {len(addrs) - len(missing)}/{len(addrs)}")
+    addr_iter = iter(missing)
+    batches = list(iter(lambda: list(islice(addr_iter, 100)), []))
+
+    # This thread is the single consumer: cached Addrs are handled first, then
+    # each batch as soon as its response arrives, so rows reach jsonl_path
+    # (if given) incrementally instead of after the whole run
+    jsonl = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENT_REQUESTS, len(batches)))) as executor:
+            fetched = executor.map(partial(fetch_geo_batch, session), batches)
+            fetched = (list(zip(batch, results)) for batch, results in zip(batches, fetched))
+            hits = [(addr, data) for addr, data in cached.items() if data is not None]
+            for chunk in chain([hits], fetched):
+                # Only fresh, successful lookups are (re)cached; failures may be
+                # transient, and re-storing hits would keep renewing their TTL
+                for addr, data in chunk:
+                    if cached[addr] is None and data and data.get('status') == 'success':
+                        cache_put(cache, addr, data)
+                located = add_chunk(chunk)
+                # One progress line per 50 Addrs rather than one per Addr
+                if len(addr_geo_map) // 50 > (len(addr_geo_map) - len(chunk)) // 50:
+                    logger.info("Geo lookups processed %d/%d", len(addr_geo_map), len(addrs))
+                if jsonl:
+                    jsonl.writelines(json.dumps({'addr': addr, **addr_geo_map[addr]}) + '\n'
+                                     for addr in located)
+                    jsonl.flush()
+    finally:
+        if jsonl:
+            jsonl.close()
     print("##############") 
     print("Total Addrs processed:", len(addr_geo_map))
-    return addr_geo_map
\ No newline at end of file
+    return addr_geo_map
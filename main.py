@@ -9,32 +9,40 @@ Usage:
     python main.py --output-dir ./results             # Custom output directory
     python main.py --skip-ping                        # Skip ping tests
     python main.py --skip-traceroute                  # Skip traceroute tests
+    python main.py --format png                       # Quick PNG plots instead of PDF
     python main.py -v                                 # Verbose output
 """
 
 import argparse
+import logging
 import sys
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 from typing import List, Optional, Dict, Tuple
 
 # Import functions from existing modules
-from extract_addrs import load_servers_dataframe, extract_addrs_list
+from extract_addrs import load_servers, select_valid_ips
 from ping_addr import ping_all_addrs
-from find_rtt import select_random_ips, run_traceroute, parse_traceroute, run_ping, write_results_to_csv
+from find_rtt import HopBatch, trace_and_parse, write_results_to_csv
 from plot_distance_rtt import plot_distance_vs_rtt
 from plot_latency_breakdown import plot_latency_breakdown
 from plot_hopcount_rtt import plot_hopcount_vs_rtt
 
 
+# Loggers of this project's modules, set to DEBUG by -v
+PROJECT_LOGGERS = ('geo_addr',)
+
+
 class ExperimentRunner:
     """Orchestrates all network experiments and plotting."""
     
-    def __init__(self, output_dir: str = ".", verbose: bool = False):
+    def __init__(self, output_dir: str = ".", verbose: bool = False, plot_format: str = "pdf"):
         self.output_dir = Path(output_dir)
         self.verbose = verbose
+        self.plot_format = plot_format
         self.stats = {
             'total_ips': 0,
             'ping_success': 0,
@@ -82,37 +90,17 @@ class ExperimentRunner:
             if input_file:
                 self.log(f"Loading IP addresses from file: {input_file}")
                 
-                # Determine file format
-                file_path = Path(input_file)
-                if not file_path.exists():
+                if not Path(input_file).exists():
                     raise FileNotFoundError(f"Input file not found: {input_file}")
                 
-                if file_path.suffix.lower() == '.csv':
-                    # Try to load as CSV with IP/HOST column
-                    df = pd.read_csv(file_path)
-                    if 'IP/HOST' in df.columns:
-                        addrs = df['IP/HOST'].dropna().tolist()
-                    elif 'ip' in df.columns:
-                        addrs = df['ip'].dropna().tolist()
-                    elif 'host' in df.columns:
-                        addrs = df['host'].dropna().tolist()
-                    else:
-                        # Assume first column contains IPs
-                        addrs = df.iloc[:, 0].dropna().tolist()
-                else:
-                    # Load as plain text file (one IP per line)
-                    with open(file_path, 'r') as f:
-                        addrs = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-                
-                # Filter out empty strings
-                addrs = [addr for addr in addrs if addr]
+                # CSV (with IP/HOST column) or plain text file (one IP per line)
+                addrs = load_servers(input_file)
                 self.log(f"Loaded {len(addrs)} IP addresses from file", "SUCCESS")
                 
             else:
                 # Fetch from website (default)
                 self.log("Fetching IP addresses from iperf3serverlist.net...")
-                df = load_servers_dataframe()
-                addrs = extract_addrs_list(df)
+                addrs = load_servers()
                 self.log(f"Fetched {len(addrs)} IP addresses from website", "SUCCESS")
             
             self.stats['total_ips'] = len(addrs)
@@ -146,6 +134,7 @@ class ExperimentRunner:
         self.print_separator()
         
         output_csv = self.output_dir / "ping_results.csv"
+        geo_jsonl = self.output_dir / "geo_results.jsonl"
         
         try:
             self.log(f"Pinging {len(addrs)} IP addresses (100 packets each)...")
@@ -153,8 +142,10 @@ class ExperimentRunner:
             
             start_time = time.time()
             
-            # Run ping for all addresses
-            results = ping_all_addrs(addrs)
+            # Run ping for all addresses; rows are written to the CSV file
+            # as each ping completes (and geo rows to the JSONL file as each
+            # lookup completes), so partial results survive a crash
+            results = ping_all_addrs(addrs, output_csv=str(output_csv), geo_jsonl=str(geo_jsonl))
             
             elapsed_time = time.time() - start_time
             
@@ -165,10 +156,6 @@ class ExperimentRunner:
                 else:
                     self.stats['ping_failed'] += 1
             
-            # Convert results to DataFrame and save
-            results_df = pd.DataFrame(results)
-            results_df.to_csv(output_csv, index=False)
-            
             self.log(f"Ping tests completed in {elapsed_time:.1f} seconds", "SUCCESS")
             self.log(f"Results saved to: {output_csv}", "SUCCESS")
             self.log(f"Success: {self.stats['ping_success']}, Failed: {self.stats['ping_failed']}")
@@ -198,9 +185,7 @@ class ExperimentRunner:
         
         try:
             # Select random IPs (prefer actual IPs over hostnames)
-            import re
-            ip_pattern = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
-            valid_ips = [addr for addr in addrs if ip_pattern.match(addr)]
+            valid_ips = select_valid_ips(addrs)
             
             if len(valid_ips) == 0:
                 self.log("No valid IP addresses found (only hostnames). Using all addresses.", "VERBOSE")
@@ -218,53 +203,40 @@ class ExperimentRunner:
             for i, ip in enumerate(selected_ips, 1):
                 self.log(f"  {i}. {ip}")
             
-            # Run traceroute for each selected IP
-            all_hops = []
+            # Trace all selected IPs concurrently; each traceroute mostly waits
+            # on the network, so wall time is roughly that of the slowest one
+            all_hops = HopBatch()
+            self.log(f"Tracing routes to {len(selected_ips)} IPs in parallel...")
             
-            for i, ip in enumerate(selected_ips, 1):
-                self.log(f"[{i}/{len(selected_ips)}] Tracing route to {ip}...")
-                
-                try:
-                    output = run_traceroute(ip)
+            with ThreadPoolExecutor(max_workers=max(1, min(8, len(selected_ips)))) as executor:
+                futures = [executor.submit(trace_and_parse, ip) for ip in selected_ips]
+                for i, (ip, future) in enumerate(zip(selected_ips, futures), 1):
+                    self.log(f"[{i}/{len(selected_ips)}] Route to {ip}:")
                     
-                    if output:
-                        hops = parse_traceroute(output, ip)
+                    try:
+                        _, hops = future.result()
                         
-                        if hops:
-                            # Filter responsive hops
-                            responsive_hops = [h for h in hops if h.get('is_responsive', True)]
-                            
-                            if responsive_hops:
-                                # Replace final hop RTT with ping result
-                                final_hop = None
-                                for hop in reversed(hops):
-                                    if hop.get('is_responsive', True) and hop.get('hop_ip'):
-                                        final_hop = hop
-                                        break
-                                
-                                if final_hop:
-                                    ping_result = run_ping(ip)
-                                    if ping_result:
-                                        final_hop['min_rtt'] = ping_result['min_rtt']
-                                        final_hop['max_rtt'] = ping_result['max_rtt']
-                                        final_hop['avg_rtt'] = ping_result['avg_rtt']
-                                
-                                all_hops.extend(hops)
-                                self.stats['traceroute_success'] += 1
-                                self.log(f"  Found {len(responsive_hops)} responsive hops", "VERBOSE")
-                            else:
-                                self.log(f"  No responsive hops found", "VERBOSE")
-                                self.stats['traceroute_failed'] += 1
-                        else:
+                        if hops is None:
+                            self.log(f"  Traceroute failed (no output)", "VERBOSE")
+                            self.stats['traceroute_failed'] += 1
+                        elif not hops:
                             self.log(f"  No hops parsed from output", "VERBOSE")
                             self.stats['traceroute_failed'] += 1
-                    else:
-                        self.log(f"  Traceroute failed (no output)", "VERBOSE")
+                        elif hops.last_responsive_index() is None:
+                            self.log(f"  No responsive hops found", "VERBOSE")
+                            self.stats['traceroute_failed'] += 1
+                        else:
+                            # trace_and_parse already replaced the final hop's RTT
+                            # with a ping measurement (only if the trace reached ip)
+                            all_hops.extend(hops)
+                            self.stats['traceroute_success'] += 1
+                            self.log(f"  Found {sum(hops.responsive)} responsive hops", "VERBOSE")
+                            if not hops.reached(ip):
+                                self.log(f"  Incomplete trace: {ip} itself never responded", "VERBOSE")
+                            
+                    except Exception as e:
+                        self.log(f"  Error tracing {ip}: {e}", "VERBOSE")
                         self.stats['traceroute_failed'] += 1
-                        
-                except Exception as e:
-                    self.log(f"  Error tracing {ip}: {e}", "VERBOSE")
-                    self.stats['traceroute_failed'] += 1
             
             # Write results to CSV
             if all_hops:
@@ -284,7 +256,7 @@ class ExperimentRunner:
     
     def generate_plots(self, ping_csv: str, traceroute_csv: str):
         """
-        Generate all PDF plots from experiment results.
+        Generate all plots from experiment results (PDF, or PNG with --format png).
         
         Args:
             ping_csv: Path to ping results CSV
@@ -296,33 +268,33 @@ class ExperimentRunner:
         
         # Plot 1: Distance vs RTT
         try:
-            self.log("Generating distance_vs_rtt.pdf...")
-            output_file = self.output_dir / "distance_vs_rtt.pdf"
+            output_file = self.output_dir / f"distance_vs_rtt.{self.plot_format}"
+            self.log(f"Generating {output_file.name}...")
             plot_distance_vs_rtt(ping_csv, str(output_file))
             self.stats['plots_generated'].append(str(output_file))
             self.log(f"Generated: {output_file}", "SUCCESS")
         except Exception as e:
-            self.log(f"Failed to generate distance_vs_rtt.pdf: {e}", "ERROR")
+            self.log(f"Failed to generate distance_vs_rtt.{self.plot_format}: {e}", "ERROR")
         
         # Plot 2: Latency Breakdown (stacked bar chart)
         try:
-            self.log("Generating latency_breakdown.pdf...")
-            output_file = self.output_dir / "latency_breakdown.pdf"
+            output_file = self.output_dir / f"latency_breakdown.{self.plot_format}"
+            self.log(f"Generating {output_file.name}...")
             plot_latency_breakdown(traceroute_csv, str(output_file))
             self.stats['plots_generated'].append(str(output_file))
             self.log(f"Generated: {output_file}", "SUCCESS")
         except Exception as e:
-            self.log(f"Failed to generate latency_breakdown.pdf: {e}", "ERROR")
+            self.log(f"Failed to generate latency_breakdown.{self.plot_format}: {e}", "ERROR")
         
         # Plot 3: Hop Count vs RTT
         try:
-            self.log("Generating hopcount_vs_rtt.pdf...")
-            output_file = self.output_dir / "hopcount_vs_rtt.pdf"
+            output_file = self.output_dir / f"hopcount_vs_rtt.{self.plot_format}"
+            self.log(f"Generating {output_file.name}...")
             plot_hopcount_vs_rtt(traceroute_csv, str(output_file))
             self.stats['plots_generated'].append(str(output_file))
             self.log(f"Generated: {output_file}", "SUCCESS")
         except Exception as e:
-            self.log(f"Failed to generate hopcount_vs_rtt.pdf: {e}", "ERROR")
+            self.log(f"Failed to generate hopcount_vs_rtt.{self.plot_format}: {e}", "ERROR")
     
     def print_summary(self):
         """Print final summary report."""
@@ -345,8 +317,10 @@ class ExperimentRunner:
         print(f"  CSV Files:")
         print(f"    - {self.output_dir / 'ping_results.csv'}")
         print(f"    - {self.output_dir / 'traceroute_results.csv'}")
+        print(f"  JSONL Files:")
+        print(f"    - {self.output_dir / 'geo_results.jsonl'}")
         
-        print(f"\n  PDF Plots:")
+        print(f"\n  {self.plot_format.upper()} Plots:")
         if self.stats['plots_generated']:
             for plot in self.stats['plots_generated']:
                 print(f"    - {plot}")
@@ -370,6 +344,7 @@ Examples:
   python main.py --output-dir ./results             # Custom output directory
   python main.py --skip-ping                        # Skip ping tests
   python main.py --skip-traceroute                  # Skip traceroute tests
+  python main.py --format png                       # Quick PNG plots instead of PDF
   python main.py -v                                 # Verbose output
         """
     )
@@ -400,6 +375,14 @@ Examples:
         help='Skip Part 2 (traceroute tests)'
     )
     
+    parser.add_argument(
+        '--format',
+        choices=['pdf', 'png'],
+        default='pdf',
+        help='Plot file format: pdf for the final deliverables, png for quicker '
+             'low-DPI exploratory plots (default: pdf)'
+    )
+    
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
@@ -414,8 +397,20 @@ def main():
     # Parse arguments
     args = parse_arguments()
     
+    # Library modules (e.g. geo_addr) report progress via logging: periodic
+    # INFO lines by default, per-address DEBUG lines with -v
+    # The root logger stays at INFO so -v doesn't also turn on the debug
+    # output of third-party libraries (matplotlib, PIL, ...); only the
+    # project's own loggers go down to DEBUG
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s] %(name)s: %(message)s', datefmt='%H:%M:%S')
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    if args.verbose:
+        for name in PROJECT_LOGGERS:
+            logging.getLogger(name).setLevel(logging.DEBUG)
+    
     # Create experiment runner
-    runner = ExperimentRunner(output_dir=args.output_dir, verbose=args.verbose)
+    runner = ExperimentRunner(output_dir=args.output_dir, verbose=args.verbose, plot_format=args.format)
     
     try:
         # Print banner
@@ -3,87 +3,214 @@
 Script to ping IP addresses/hosts from Python list
 and report min, max, and average round-trip times.
 """
-from numpy import long
-import pandas as pd
-from icmplib import ping
-from extract_addrs import extract_addrs_list, load_servers_dataframe
+import asyncio
+import csv
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from icmplib import async_ping, ping
+from extract_addrs import load_servers
 from geo_addr import get_geo
 
-def ping_addr(addr_or_hostname: str) -> dict:
+# icmplib ping settings shared by the single and concurrent paths
+PING_KWARGS = dict(count=100, interval=0.2, timeout=10, privileged=False)
+
+# Columns of a ping result row (see ping_result / ping_error)
+PING_FIELDS = ['addr', 'min_rtt', 'max_rtt', 'avg_rtt', 'packet_loss',
+               'geo_distance_km', 'longitude', 'latitude', 'location', 'error']
+
+
+def geo_fields(geo: dict) -> tuple:
+    """Return (distance_km, longitude, latitude, location) from a get_geo() entry, None where unknown."""
+    # Only located entries carry a distance (failed lookups are {'error': ...})
+    if geo.get('distance_km') is None:
+        return None, None, None, None
+    location = ', '.join(geo[key] for key in ('city', 'regionName', 'country')
+                         if geo.get(key) not in (None, '', 'N/A'))
+    return geo['distance_km'], geo.get('lon'), geo.get('lat'), location or None
+
+
+def ping_result(addr_or_hostname: str, response, geo_lookup: dict) -> dict:
+    """Build the statistics row for a completed ping (icmplib Host), adding geolocation."""
+    # geo_lookup maps addr -> get_geo() entry; missing addrs just get no geolocation
+    distance, longitude, latitude, location = geo_fields(geo_lookup.get(addr_or_hostname, {}))
+    
+    return {
+        'addr': addr_or_hostname,
+        'min_rtt': response.min_rtt,
+        'max_rtt': response.max_rtt,
+        'avg_rtt': response.avg_rtt,
+        'packet_loss': response.packet_loss,
+        'geo_distance_km': distance,
+        'longitude': longitude,
+        'latitude': latitude,
+        'location': location,
+        'error': None
+    }
+
+
+def ping_error(addr_or_hostname: str, e: Exception) -> dict:
+    """Build the row for a nonresponsive server or other ping error."""
+    return {
+        'addr': addr_or_hostname,
+        'min_rtt': None,
+        'max_rtt': None,
+        'avg_rtt': None,
+        'packet_loss': None,
+        'geo_distance_km': None,
+        'longitude': None,
+        'latitude': None,
+        'location': None,
+        'error': str(e)
+    }
+
+
+def lookup_geo_safe(addrs: list[str], jsonl_path: Optional[str] = None) -> dict:
+    """
+    get_geo(addrs, jsonl_path), or {} if the lookup fails: geolocation is optional,
+    so a failed lookup must never cost the ping results (rows just lack geo fields).
+    """
+    try:
+        return get_geo(addrs, jsonl_path) or {}
+    except Exception as e:
+        print(f"Geolocation lookup failed: {e}")
+        return {}
+
+
+def ping_addr(addr_or_hostname: str, geo_lookup: dict = None) -> dict:
     """Ping an IP address/hostname and return round-trip time statistics."""
     
     try:
         # Ping handles both IP addresses and hostnames
         print("--------------------------------")
         print(f"Pinging {addr_or_hostname}...")
-        response = ping(addr_or_hostname, count=100, interval=0.2, timeout=10, privileged=False)
-        
-        # Try to get geolocation 
-        distance = None
-        location = None
-        try:
-            geo_data = get_geo([addr_or_hostname])
-            # handle error 
-            if geo_data:
-                distance = geo_data.get(addr_or_hostname, {}).get('distance_km')
-                longitude = geo_data.get(addr_or_hostname, {}).get('longitude')
-                latitude = geo_data.get(addr_or_hostname, {}).get('latitude')
-                location = geo_data.get(addr_or_hostname, {}).get('location')
-                if distance is None or location is None or longitude is None or latitude is None or distance == 'N/A' or location == 'N/A' or longitude == 'N/A' or latitude == 'N/A':
-                    raise Exception("Geolocation data incomplete")
-            else:
-                raise Exception("Geolocation data not found")
-        except Exception:
-            # If geolocation fails (e.g., hostname not resolved), continue without it
-            pass
-        print("--------------------------------")
-        
-        return {
-            'addr': addr_or_hostname,
-            'min_rtt': response.min_rtt,
-            'max_rtt': response.max_rtt,
-            'avg_rtt': response.avg_rtt,
-            'packet_loss': response.packet_loss,
-            'geo_distance_km': distance,
-            'longitude': longitude,
-            'latitude': latitude,
-            'location': location,
-            'error': None
-        }
+        response = ping(addr_or_hostname, **PING_KWARGS)
     except Exception as e:
         # Handle nonresponsive servers or other errors
-        return {
-            'addr': addr_or_hostname,
-            'min_rtt': None,
-            'max_rtt': None,
-            'avg_rtt': None,
-            'packet_loss': None,
-            'geo_distance_km': None,
-            'longitude': None,
-            'latitude': None,
-            'location': None,
-            'error': str(e)
-        }
+        return ping_error(addr_or_hostname, e)
     
-def ping_all_addrs(addrs: list[str]) -> list[dict]:
-    """Ping all IP addresses/hosts in the list and return their statistics."""
-    results = []
-    for addr in addrs:
-        stats = ping_addr(addr)
-        results.append(stats)
-    return results
+    # A failed geo lookup leaves the geo fields empty, not the ping an error
+    if geo_lookup is None:
+        geo_lookup = lookup_geo_safe([addr_or_hostname])
+    result = ping_result(addr_or_hostname, response, geo_lookup)
+    print("--------------------------------")
+    return result
 
 
-def main():
-    url = 'https://export.iperf3serverlist.net/listed_iperf3_servers.csv'
+async def _ping_all(targets: list[str], max_concurrent: int, on_result) -> None:
+    """
+    Ping every target on one event loop, at most max_concurrent at a time.
+    on_result(index, response) is awaited as each ping finishes, with the
+    icmplib Host or the exception it raised.
+    """
+    semaphore = asyncio.Semaphore(max_concurrent)
     
-    # Load into pandas DataFrame
-    df = load_servers_dataframe(url)
+    async def ping_one(index, target):
+        async with semaphore:
+            print(f"Pinging {target}...")
+            try:
+                response = await async_ping(target, **PING_KWARGS)
+            except Exception as e:
+                # One unreachable host must not cancel the rest
+                response = e
+        await on_result(index, response)
     
-    # Extract Addrs (IPs, hostnames) as a list
-    addrs = extract_addrs_list(df)
+    await asyncio.gather(*(ping_one(i, target) for i, target in enumerate(targets)))
+
+
+def resolve_addr(addr_or_hostname: str) -> Optional[str]:
+    """Resolve a hostname to its IPv4 address (IPs come back unchanged), or None if it doesn't resolve."""
+    try:
+        return socket.gethostbyname(addr_or_hostname)
+    except (socket.gaierror, UnicodeError):
+        return None
+
+
+def resolve_all(addrs: list[str], max_workers: int = 64) -> dict:
+    """Resolve all addresses concurrently; returns addr -> IPv4 address (or None)."""
+    # gethostbyname blocks on DNS, so overlap the lookups on a thread pool
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(addrs, executor.map(resolve_addr, addrs)))
+
+
+def ping_all_addrs(addrs: list[str], max_concurrent: int = 64, output_csv: Optional[str] = None,
+                   geo_jsonl: Optional[str] = None) -> list[dict]:
+    """
+    Ping all IP addresses/hosts in the list and return their statistics,
+    one row per distinct address (duplicates in addrs are pinged once).
+    
+    If output_csv is given, each row is also appended to that CSV as soon as
+    its ping completes (in completion order), so partial results survive an
+    interrupted run. Likewise, if geo_jsonl is given, each geolocated IP is
+    appended to that file as one JSON line as soon as its lookup completes.
+    """
+    # Resolve hostnames once, up front and in parallel; names that don't
+    # resolve are reported without being pinged or geolocated
+    resolved = resolve_all(addrs)
+    targets = [addr for addr in dict.fromkeys(addrs) if resolved[addr]]
+    ips = [resolved[addr] for addr in targets]
+    
+    # get_geo appends to geo_jsonl, so start this run from an empty file
+    if geo_jsonl:
+        open(geo_jsonl, 'w', encoding='utf-8').close()
+    
+    rows = {}
+    csv_file = open(output_csv, 'w', newline='', encoding='utf-8') if output_csv else None
+    try:
+        writer = csv.DictWriter(csv_file, fieldnames=PING_FIELDS) if csv_file else None
+        if writer:
+            writer.writeheader()
+        
+        # Only ever called from the event loop thread, so this is the single writer
+        def record(addr, response, geo_lookup=None):
+            if isinstance(response, Exception):
+                rows[addr] = ping_error(addr, response)
+            else:
+                rows[addr] = ping_result(addr, response, geo_lookup)
+            if writer:
+                writer.writerow(rows[addr])
+                csv_file.flush()
+        
+        for addr in dict.fromkeys(addrs):
+            if not resolved[addr]:
+                record(addr, LookupError(f"Could not resolve {addr}"))
+        
+        async def ping_and_geolocate():
+            # Geolocate every resolved IP in one batched get_geo() call rather
+            # than one lookup per pinged host. get_geo blocks on HTTP, so it
+            # runs on a worker thread while the pings are in flight, and the
+            # total time is max(ping, geo) rather than their sum
+            async def lookup_geo():
+                # (a failed lookup gives {}, so every ping is still recorded)
+                geo_by_ip = await asyncio.to_thread(lookup_geo_safe, ips, geo_jsonl)
+                return {addr: geo_by_ip.get(resolved[addr], {}) for addr in targets}
+            geo_task = asyncio.create_task(lookup_geo())
+            
+            # A finished ping only waits for the geo lookup if it is still running
+            async def on_result(i, response):
+                record(targets[i], response, await geo_task)
+            
+            # Each ping mostly waits on the network (100 packets, ~20 s), so they all
+            # run concurrently as asyncio ICMP sockets
+            await _ping_all(ips, max_concurrent, on_result)
+            await geo_task
+        
+        asyncio.run(ping_and_geolocate())
+    finally:
+        if csv_file:
+            csv_file.close()
+    
+    # Results keep the order of addrs, one row per distinct addr (as written to output_csv)
+    return [rows[addr] for addr in dict.fromkeys(addrs)]
+
+
+def main():
+    # Load Addrs (IPs, hostnames) as a list
+    addrs = load_servers()
     
-    results = ping_all_addrs(addrs)
+    # Rows are written to the CSV file as each ping completes
+    output_csv = 'ping_results.csv'
+    results = ping_all_addrs(addrs, output_csv=output_csv)
     for result in results:
         if result['error']:
             print(f"Addr {result['addr']} - Error: {result['error']}")
@@ -93,14 +220,14 @@ def main():
                   f"Geo Distance: {result['geo_distance_km']} km, Longitude: {result['longitude']}, Latitude: {result['latitude']}, Location: {result['location']}")
 
     # Convert results to DataFrame for better visualization if needed
+    # (pandas is only needed for this preview, so it is imported here rather
+    # than at module scope, keeping `import ping_addr` from main.py cheap)
+    import pandas as pd
     results_df = pd.DataFrame(results)
     print("\n# Ping Results DataFrame Preview:")
     print(results_df.head(10))
     print(f"\n# Ping Results DataFrame shape: {results_df.shape}")
     
-    # Save results to CSV file
-    output_csv = 'ping_results.csv'
-    results_df.to_csv(output_csv, index=False)
     print(f"\n# Results saved to {output_csv}")
 
 if __name__ == '__main__':
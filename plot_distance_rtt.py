@@ -4,9 +4,10 @@ Script to create a scatter plot: distance vs RTT
 where distance is the geographical distance between your location and destination IP address.
 """
 
-import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+from csv_cache import read_csv_cached
+from plot_utils import save_figure
 
 def plot_distance_vs_rtt(csv_file: str = 'ping_results.csv', output_file: str = 'distance_vs_rtt.pdf'):
     """
@@ -17,23 +18,29 @@ def plot_distance_vs_rtt(csv_file: str = 'ping_results.csv', output_file: str =
         output_file: Path to save the plot image
     """
     # Read the CSV file
-    df = pd.read_csv(csv_file)
+    # Only the columns used below are parsed, with explicit dtypes so pandas
+    # skips type inference
+    df = read_csv_cached(csv_file,
+                         usecols=['geo_distance_km', 'avg_rtt', 'error'],
+                         dtype={'geo_distance_km': 'float32', 'avg_rtt': 'float32', 'error': 'object'})
     
     # Filter out rows with missing data (errors, None values)
-    # Also filter out RTT values <= 0 or very small (< 1 ms) which likely indicate blocked/failed pings
-    df_clean = df[
+    # Each mask is computed once and reused for the filtered-out count below
+    valid = (
         df['geo_distance_km'].notna() & 
         df['avg_rtt'].notna() & 
-        (df['error'].isna() | (df['error'] == '')) &
-        (df['avg_rtt'] > 1.0)  # Filter out RTT <= 1 ms (likely blocked/failed pings)
-    ].copy()
+        (df['error'].isna() | (df['error'] == ''))
+    )
+    # Also filter out RTT values <= 0 or very small (< 1 ms) which likely indicate blocked/failed pings
+    # Only the two plotted columns are selected, so no full-row copy is made
+    df_clean = df.loc[valid & (df['avg_rtt'] > 1.0), ['geo_distance_km', 'avg_rtt']]
     
     if len(df_clean) == 0:
         print("No valid data points found for plotting.")
         return
     
     # Count how many points were filtered out
-    total_valid = len(df[df['geo_distance_km'].notna() & df['avg_rtt'].notna() & (df['error'].isna() | (df['error'] == ''))])
+    total_valid = int(valid.sum())
     filtered_out = total_valid - len(df_clean)
     if filtered_out > 0:
         print(f"Filtered out {filtered_out} data point(s) with RTT <= 1 ms (likely blocked/failed pings)")
@@ -41,7 +48,7 @@ def plot_distance_vs_rtt(csv_file: str = 'ping_results.csv', output_file: str =
     print(f"Plotting {len(df_clean)} data points...")
     
     # Create the scatter plot
-    plt.figure(figsize=(10, 6))
+    fig = plt.figure(figsize=(10, 6))
     plt.scatter(df_clean['geo_distance_km'], df_clean['avg_rtt'], 
                 alpha=0.6, s=50, edgecolors='black', linewidth=0.5)
     
@@ -52,7 +59,11 @@ def plot_distance_vs_rtt(csv_file: str = 'ping_results.csv', output_file: str =
     plt.grid(True, alpha=0.3, linestyle='--')
     
     # Add some statistics as text
-    correlation = df_clean['geo_distance_km'].corr(df_clean['avg_rtt'])
+    # df_clean is already NaN-free, so plain np.corrcoef on float32 arrays
+    # suffices (no per-call NaN masking as in Series.corr)
+    distances = df_clean['geo_distance_km'].to_numpy(np.float32)
+    rtts = df_clean['avg_rtt'].to_numpy(np.float32)
+    correlation = float(np.corrcoef(distances, rtts)[0, 1])
     plt.text(0.05, 0.95, f'Correlation: {correlation:.3f}', 
              transform=plt.gca().transAxes, fontsize=10,
              verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5))
@@ -60,13 +71,16 @@ def plot_distance_vs_rtt(csv_file: str = 'ping_results.csv', output_file: str =
     # Tight layout for better appearance
     plt.tight_layout()
     
-    # Save the plot
-    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+    # Save the plot (PDF, or PNG with main.py --format png)
+    save_figure(fig, output_file)
     print(f"Plot saved to {output_file}")
     
     # Optionally display the plot (uncomment if running interactively)
     # plt.show()
     
+    # Close the figure to free its canvas
+    plt.close(fig)
+    
     # Print some statistics
     print(f"\nStatistics:")
     print(f"  Total valid data points: {len(df_clean)}")
@@ -9,12 +9,32 @@ We compute incremental RTT: the additional latency added by each hop along the p
 This allows us to stack segments where each segment represents one hop's contribution.
 """
 
-import pandas as pd
+from functools import lru_cache
+from typing import Optional
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
+from csv_cache import read_csv_cached
+from plot_utils import save_figure
 
+# Above this many bar segments (destinations x hops) the bars are rasterized:
+# in a PDF every segment is otherwise a separate vector path, which dominates
+# file size and save time; axes, labels and the legend stay vector
+RASTERIZE_MIN_SEGMENTS = 500
 
-def load_and_compute_incremental_rtt(csv_file: str = 'traceroute_results.csv') -> pd.DataFrame:
+
+@lru_cache(maxsize=64)
+def _hop_colors(n_hops: int) -> np.ndarray:
+    """
+    Sample n_hops evenly spaced colors from the viridis colormap.
+    Cached per n_hops (the array is read-only since callers share it).
+    """
+    colors = plt.cm.viridis(np.linspace(0, 1, n_hops))
+    colors.setflags(write=False)
+    return colors
+
+
+def load_and_compute_incremental_rtt(csv_file: str = 'traceroute_results.csv') -> tuple[np.ndarray, np.ndarray]:
     """
     Load traceroute results and compute incremental RTT per hop for each destination.
     
@@ -28,68 +48,73 @@ def load_and_compute_incremental_rtt(csv_file: str = 'traceroute_results.csv') -
     The sum of all incremental RTTs equals the total end-to-end RTT.
 
     Returns:
-        DataFrame with index=destination_ip, columns=Hop_1, Hop_2, ... (incremental RTT in ms)
+        (dests, matrix): dests is an array of the destination IPs, and matrix a
+        float32 array of shape (len(dests), max_hops) whose row i holds the
+        incremental RTTs (in ms) of Hop 1, Hop 2, ... for dests[i], zero-padded.
+        Both are empty if there is no data.
     """
     # Read the CSV file containing traceroute results
-    df = pd.read_csv(csv_file)
+    # Only the three columns used below are parsed, with explicit dtypes
+    # Categorical destination_ip: sorting and groupby work on the integer
+    # category codes instead of hashing every IP string
+    # float32 avg_rtt: plenty for RTTs in ms, and half the bytes per value
+    df = read_csv_cached(csv_file,
+                         usecols=['destination_ip', 'hop_number', 'avg_rtt'],
+                         dtype={'destination_ip': 'category', 'hop_number': 'int16', 'avg_rtt': 'float32'})
     if df.empty:
-        return pd.DataFrame()
+        return np.empty(0, dtype=object), np.empty((0, 0), dtype=np.float32)
 
     # Sort by destination_ip first, then by hop_number within each destination
     # This ensures hops are processed in order for each destination
     df = df.sort_values(['destination_ip', 'hop_number'])
 
-    # Process each destination IP separately
-    records = []
-    for dest_ip, group in df.groupby('destination_ip'):
-        # Sort the group by hop_number to ensure hops are in correct order
-        # (traceroute may have gaps in hop_number due to filtered non-responsive hops)
-        group = group.sort_values('hop_number')
-        
-        # Extract the average RTT values for all hops in order
-        rtts = group['avg_rtt'].values
-        
-        # Compute incremental RTT for each hop
-        # prev_rtt tracks the cumulative RTT up to the previous hop
-        prev_rtt = 0.0  # Start with 0 for the first hop
-        increments = []
-        
-        for rtt in rtts:
-            # Incremental RTT = current RTT - previous RTT
-            # This gives us the latency added by this specific hop
-            # max(0.0, ...) ensures we never have negative increments (safety check)
-            inc = max(0.0, float(rtt) - prev_rtt)
-            increments.append(inc)
-            prev_rtt = float(rtt)  # Update for next iteration
-        
-        # Store the destination IP and its list of incremental RTTs
-        records.append((dest_ip, increments))
-
-    # Find the maximum number of hops across all destinations
-    # This determines how many columns we need in the DataFrame
-    max_hops = max(len(r[1]) for r in records)
-    
-    # Create column names: "Hop 1", "Hop 2", ..., "Hop N"
-    col_names = [f'Hop {i + 1}' for i in range(max_hops)]
-
-    # Build rows for the DataFrame
-    # Each row represents one destination IP
-    rows = []
-    for dest_ip, incs in records:
-        # Pad shorter paths with zeros so all rows have the same length
-        # This is necessary for creating a rectangular DataFrame
-        # Destinations with fewer hops will have zeros for the extra hop columns
-        row = incs + [0.0] * (max_hops - len(incs))
-        rows.append(row)
-
-    # Create DataFrame: rows = destinations, columns = Hop 1, Hop 2, ..., Hop N
-    # Index is the destination IP addresses
-    return pd.DataFrame(rows, index=[r[0] for r in records], columns=col_names)
+    # Sort-based group-by: after the sort each destination's hops are one
+    # contiguous run of rows, so a run starts wherever the category code
+    # changes from the previous row (found in one linear pass; the codes are
+    # already sorted, so no second sort such as np.unique's is needed)
+    # Only destinations present in the data get a run
+    dest_codes = df['destination_ip'].cat.codes.to_numpy()
+    starts = np.flatnonzero(np.r_[True, dest_codes[1:] != dest_codes[:-1]])
+    counts = np.diff(np.r_[starts, len(dest_codes)])
+    dests = df['destination_ip'].cat.categories[dest_codes[starts]]
+
+    # Row of each hop in the output (its destination's run) and its position
+    # in that destination's path: 0, 1, 2, ...
+    # This position (not hop_number) becomes the hop column, because traceroute
+    # may have gaps in hop_number due to filtered non-responsive hops
+    dest_row = np.repeat(np.arange(len(starts)), counts)
+    hop_index = np.arange(len(dest_codes)) - np.repeat(starts, counts)
+
+    # Extract the average RTT values for all hops, grouped by destination and
+    # in hop order
+    rtts = df['avg_rtt'].to_numpy(dtype=np.float32)
+
+    # Compute incremental RTT for every hop of every destination in one pass
+    # Incremental RTT = current RTT - previous RTT, i.e. the latency added by
+    # this specific hop; each destination's first hop has previous RTT 0, so
+    # it keeps its own RTT
+    # np.maximum(..., 0.0) ensures we never have negative increments (safety check)
+    # (prepend a float32 zero so the increments stay float32)
+    increments = np.diff(rtts, prepend=np.float32(0.0))
+    first_hop = hop_index == 0
+    increments[first_hop] = rtts[first_hop]
+    np.maximum(increments, 0.0, out=increments)
+
+    # Scatter the increments into one preallocated matrix:
+    # rows = destinations, columns = hops (max_hops = longest path)
+    # Shorter paths are left padded with zeros in the extra hop columns
+    max_hops = int(counts.max())
+    matrix = np.zeros((len(dests), max_hops), dtype=np.float32)
+    matrix[dest_row, hop_index] = increments
+
+    # The plot draws straight from the matrix, so no DataFrame is built
+    return dests.to_numpy(dtype=object), matrix
 
 
 def plot_latency_breakdown(
     csv_file: str = 'traceroute_results.csv',
-    output_file: str = 'latency_breakdown.pdf',
+    output_file: Optional[str] = 'latency_breakdown.pdf',
+    ax: Optional[plt.Axes] = None,
 ):
     """
     Plot a stacked bar chart: one bar per destination IP, segments = incremental
@@ -99,37 +124,61 @@ def plot_latency_breakdown(
     where each segment corresponds to one hop along the path. The height of each
     segment shows the incremental latency added by that hop. The total bar height
     equals the end-to-end RTT to that destination.
+
+    Args:
+        csv_file: Path to the CSV file containing traceroute results
+        output_file: Path to save the plot image, or None to leave saving to the caller
+        ax: Axes to draw into (cleared first), so a caller producing many plots can
+            reuse one figure; by default a new figure is created and closed after saving
     """
     # Load and compute incremental RTT for each hop of each destination
-    # Returns DataFrame: rows = destination IPs, columns = Hop 1, Hop 2, ..., Hop N
-    df = load_and_compute_incremental_rtt(csv_file)
-    if df.empty:
+    # Returns destination IPs and a matrix: rows = destination IPs, columns = Hop 1, Hop 2, ..., Hop N
+    dests, data = load_and_compute_incremental_rtt(csv_file)
+    if data.size == 0:
+        # A reused axes must not keep (and its caller save) the previous chart
+        if ax is not None:
+            ax.clear()
         print("No data in traceroute_results.csv. Run find_rtt.py first.")
         return
 
     # Get the number of hop columns (maximum hops across all destinations)
-    n_hops = df.shape[1]
+    n_hops = data.shape[1]
     
     # Generate colors for each hop segment using the viridis colormap
     # viridis: perceptually uniform, colorblind-friendly, goes from dark purple to yellow
     # np.linspace(0, 1, n_hops): Creates n_hops evenly spaced values from 0 to 1
     # This maps to colors: first hops = dark purple/blue (cooler), last hops = yellow (hotter)
     # This visual progression helps distinguish early hops from late hops
-    colors = plt.cm.viridis(np.linspace(0, 1, n_hops))
+    # (sampled once per hop count, see _hop_colors)
+    colors = _hop_colors(n_hops)
 
-    # Create figure and axis objects
+    # Create figure and axis objects, unless the caller passed axes to reuse
     # figsize=(10, 6): Width=10 inches, Height=6 inches
-    fig, ax = plt.subplots(figsize=(10, 6))
-
-    # Create stacked bar chart using pandas plot function
-    # kind='bar': Bar chart type
-    # stacked=True: Stack segments on top of each other (required for breakdown visualization)
-    # ax=ax: Use the axis object we created
-    # color=colors: Use our color array (one color per hop segment)
+    own_figure = ax is None
+    if own_figure:
+        fig, ax = plt.subplots(figsize=(10, 6))
+    else:
+        fig = ax.figure
+        ax.clear()
+
+    # Create stacked bar chart: one ax.bar call per hop, stacked on the total
+    # of the previous hops (what pandas' stacked=True does internally, without
+    # its per-column bookkeeping)
+    # All bottoms are computed up front in one cumsum: column i holds the sum
+    # of hops 1..i-1 for every destination (zeros for the first hop)
+    # bottom=bottoms[:, i]: Each hop segment starts where the previous hops end
+    # color=colors[i]: One color per hop segment
     # width=0.7: Bar width as fraction of available space (70% of category width)
     # edgecolor='white': White border between segments for better visual separation
     # linewidth=0.5: Thin border lines
-    df.plot(kind='bar', stacked=True, ax=ax, color=colors, width=0.7, edgecolor='white', linewidth=0.5)
+    # rasterized: Draw the segments as one image when there are very many
+    x = np.arange(data.shape[0])
+    bottoms = np.zeros_like(data)
+    np.cumsum(data[:, :-1], axis=1, out=bottoms[:, 1:])
+    rasterize = data.size > RASTERIZE_MIN_SEGMENTS
+    for i in range(n_hops):
+        ax.bar(x, data[:, i], bottom=bottoms[:, i], color=colors[i], width=0.7,
+               edgecolor='white', linewidth=0.5, label=f'Hop {i + 1}', rasterized=rasterize)
 
     # Set axis labels and title
     ax.set_xlabel('Destination IP Address', fontsize=12)
@@ -139,7 +188,8 @@ def plot_latency_breakdown(
     # Rotate x-axis labels for better readability (IP addresses can be long)
     # rotation=15: Rotate labels 15 degrees
     # ha='right': Right-align rotated labels
-    ax.set_xticklabels(ax.get_xticklabels(), rotation=15, ha='right')
+    ax.set_xticks(x)
+    ax.set_xticklabels(dests, rotation=15, ha='right')
     
     # Add legend showing which color corresponds to which hop
     # title='Hop': Legend title
@@ -159,19 +209,25 @@ def plot_latency_breakdown(
     ax.set_axisbelow(True)
 
     # Adjust layout to prevent label cutoff
-    plt.tight_layout()
+    fig.tight_layout()
     
-    # Save the plot as PDF
-    # dpi=300: High resolution (300 dots per inch) for publication quality
-    # bbox_inches='tight': Include all elements (legend, labels) in saved image
-    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+    # Save the plot as PDF (or PNG with main.py --format png; see save_figure)
+    # PDF dpi=200 when the bars are rasterized: dpi only sets the resolution
+    # of that image, and 200 keeps it sharp at a fraction of the size
+    if output_file is not None:
+        save_figure(fig, output_file, pdf_dpi=200 if rasterize else 300)
+        print(f"Stacked bar chart saved to {output_file}")
     
-    # Close the figure to free memory
-    plt.close()
-    print(f"Stacked bar chart saved to {output_file}")
+    # Close the figure to free memory (a caller's figure is left to the caller)
+    if own_figure:
+        plt.close(fig)
 
 
 def main():
+    # Run as a script this only ever saves to a file, so use the
+    # non-interactive Agg backend: no GUI toolkit is loaded, and it works on
+    # headless machines (importers such as main.py keep their own backend)
+    matplotlib.use('Agg')
     plot_latency_breakdown()
 
 
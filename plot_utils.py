@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the plot scripts.
+"""
+
+import matplotlib.figure
+
+
+def save_figure(fig: matplotlib.figure.Figure, output_file: str, pdf_dpi: int = 300):
+    """
+    Save a figure as PDF (the final deliverables) or PNG (quick exploratory plots).
+
+    PDF is saved at pdf_dpi with bbox_inches='tight', so every element (legend,
+    labels, annotations) is included. A .png output (main.py --format png) is a
+    120 dpi raster without bbox_inches='tight', which re-renders the figure just
+    to measure it; the scripts' tight_layout() call already fits the labels.
+
+    Args:
+        fig: Figure to save
+        output_file: Output path; the extension selects the format
+        pdf_dpi: Resolution for PDF output (this only affects rasterized artists)
+    """
+    if output_file.endswith('.png'):
+        fig.savefig(output_file, dpi=120)
+    else:
+        fig.savefig(output_file, dpi=pdf_dpi, bbox_inches='tight')